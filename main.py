@@ -6,23 +6,32 @@ import signal
 import logging
 import asyncio
 import hashlib
-from typing import Optional, Dict, Any, List
+import html
+import functools
+from typing import Optional, Dict, Any, List, Tuple, Iterator
 
 import aiohttp
+import orjson
 from telegram import (
+    Chat,
+    Message,
     Update,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
 )
 from telegram.constants import ParseMode
+from telegram.error import BadRequest
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     ApplicationBuilder,
+    ApplicationHandlerStop,
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
     ContextTypes,
     ConversationHandler,
+    Defaults,
     filters,
 )
 
@@ -52,21 +61,29 @@ if not WIFE_TG_ID:
     raise RuntimeError("WIFE_TG_ID is missing")
 
 
-def _default_webhook_path() -> str:
-    h = hashlib.sha256(BOT_TOKEN.encode("utf-8")).hexdigest()
-    return f"tg/{h[:24]}"
+# путь вебхука по умолчанию — из хэша токена, считаем один раз
+_DEFAULT_WEBHOOK_PATH = "tg/" + hashlib.sha256(BOT_TOKEN.encode("utf-8")).hexdigest()[:24]
 
 
 # =========================
 # [+] Persistent HTTP session
 # =========================
 _http_session: Optional[aiohttp.ClientSession] = None
+# сессия ходит только в GAS, и всегда с JSON — заголовки задаём один раз на сессию
+_GAS_HEADERS = {"Content-Type": "application/json", "User-Agent": "ira-finance-bot"}
 
 
 async def get_http_session() -> aiohttp.ClientSession:
     global _http_session
     if _http_session is None or _http_session.closed:
-        _http_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=12))
+        # один keep-alive пул к GAS: без повторного TLS-рукопожатия на каждый запрос
+        connector = aiohttp.TCPConnector(limit=10, ttl_dns_cache=300, keepalive_timeout=60)
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            headers=_GAS_HEADERS,
+            # GAS отвечает медленно, но соединение должно подниматься быстро
+            timeout=aiohttp.ClientTimeout(total=12, sock_connect=3),
+        )
         logger.info("HTTP session created")
     return _http_session
 
@@ -81,12 +98,125 @@ async def close_http_session() -> None:
 # =========================
 # [+] Month summary cache
 # =========================
-_month_cache: Dict[str, Any] = {}
+class _MonthCache:
+    """Сводка месяца и готовый текст главного экрана; gen растёт при каждой записи."""
+
+    __slots__ = ("gen", "data", "html", "stale_at", "expires_at")
+
+    def __init__(self) -> None:
+        self.gen = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self.data: Optional[Dict[str, Any]] = None
+        self.html = ""
+        self.stale_at = 0
+        self.expires_at = 0
+
+
+_month_cache = _MonthCache()
+_month_lock = asyncio.Lock()
 CACHE_TTL = 60
+# [+] stale-while-revalidate: после CACHE_TTL отдаём старую сводку и обновляем её в фоне,
+# после CACHE_HARD_TTL — ждём свежую
+CACHE_HARD_TTL = 600
+_month_refresh: Optional[asyncio.Task] = None
+
+# [+] короткий кэш остальных чтений (список записей, анализ): payload → (expires_at в нс, data)
+_read_cache: Dict[bytes, Tuple[int, Any]] = {}
+READ_CACHE_TTL = 30
+
+# запрос списка последних записей для "Изменить"; сводка месяца может принести его ответ с собой
+RECENT_TX_LIMIT = 5
+# ключ _read_cache для {"cmd": "get_recent_transactions", "limit": RECENT_TX_LIMIT}
+_RECENT_TX_KEY = orjson.dumps(
+    {"cmd": "get_recent_transactions", "limit": RECENT_TX_LIMIT}, option=orjson.OPT_SORT_KEYS
+)
+
 
+def _jittered_ns(ttl: float) -> int:
+    # TTL в секундах → наносекунды, ±10%, чтобы записи кэша не протухали все в одну секунду
+    return int(ttl * random.uniform(0.9, 1.1) * 1_000_000_000)
 
-def _invalidate_month_cache() -> None:
-    _month_cache.clear()
+
+def _invalidate_caches() -> None:
+    # gen отбрасывает ответ запроса, который был в полёте во время записи
+    _month_cache.gen += 1
+    _month_cache.reset()
+    _read_cache.clear()
+
+
+def _cached_month_summary() -> Optional[Dict[str, Any]]:
+    now = time.monotonic_ns()
+    if now >= _month_cache.expires_at:
+        return None
+    if now >= _month_cache.stale_at:
+        _schedule_month_refresh()
+    return _month_cache.data
+
+
+def _schedule_month_refresh() -> None:
+    global _month_refresh
+    if _month_refresh is None or _month_refresh.done():
+        _month_refresh = asyncio.create_task(_refresh_month_summary())
+
+
+async def _refresh_month_summary() -> None:
+    try:
+        async with _month_lock:
+            # пока ждали lock, сводку мог обновить кто-то другой
+            if time.monotonic_ns() < _month_cache.stale_at:
+                return
+            await _load_month_summary()
+    except Exception as e:
+        logger.warning("Month summary refresh failed: %s", e)
+
+
+async def _load_month_summary() -> Dict[str, Any]:
+    # вызывать под _month_lock
+    gen = _month_cache.gen
+    s = await gas_request({"cmd": "summary_month", "recent_limit": RECENT_TX_LIMIT})
+    if _month_cache.gen == gen:
+        _store_month_summary(s)
+    return s
+
+
+async def _fetch_month_summary() -> Dict[str, Any]:
+    s = _cached_month_summary()
+    if s is not None:
+        return s
+    # одновременные промахи ждут один и тот же запрос к GAS
+    async with _month_lock:
+        s = _cached_month_summary()
+        if s is not None:
+            return s
+        return await _load_month_summary()
+
+
+def _store_month_summary(s: Dict[str, Any]) -> None:
+    # [+] вместе с данными храним готовый текст главного экрана
+    now = time.monotonic_ns()
+    _month_cache.data = s
+    _month_cache.html = _render_month(s)
+    _month_cache.stale_at = now + _jittered_ns(CACHE_TTL)
+    _month_cache.expires_at = now + _jittered_ns(CACHE_HARD_TTL)
+    # [+] если GAS положил в сводку последние записи — "Изменить" обойдётся без своего запроса
+    recent = s.get("recent_transactions")
+    if isinstance(recent, list):
+        _read_cache[_RECENT_TX_KEY] = (now + _jittered_ns(READ_CACHE_TTL), {"transactions": recent})
+
+
+async def cached_gas_request(payload: Dict[str, Any], ttl: float = READ_CACHE_TTL) -> Dict[str, Any]:
+    """gas_request для идемпотентных чтений; любая запись сбрасывает кэш через _invalidate_caches()."""
+    key = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+    hit = _read_cache.get(key)
+    if hit and time.monotonic_ns() < hit[0]:
+        return hit[1]
+    gen = _month_cache.gen
+    data = await gas_request(payload)
+    if _month_cache.gen == gen:
+        _read_cache[key] = (time.monotonic_ns() + _jittered_ns(ttl), data)
+    return data
 
 
 # =========================
@@ -137,6 +267,10 @@ EXPENSES: Dict[str, List[str]] = {
     "Красота": ["Маникюр", "Педикюр", "Парикмахер", "Убирание волос", "Массаж", "Другое"],
 }
 
+# Индексы из callback_data ("expcat:3", "expsub:1") смотрят в эти кортежи
+EXPENSE_KEYS: Tuple[str, ...] = tuple(EXPENSES)
+SUBS_BY_CAT: Dict[str, Tuple[str, ...]] = {k: tuple(v) for k, v in EXPENSES.items()}
+
 INCOME_CATEGORIES = [
     "Муж", "Государство", "% по вкладам", "Возвраты", "Подарки", "Случайные доходы", "Продажи"
 ]
@@ -145,7 +279,7 @@ INCOME_CATEGORIES = [
 # =========================
 # Phrases
 # =========================
-PH_EXP_CAT = [
+PH_EXP_CAT = (
     "На что потратилась, Иришка? 🙂",
     "Куда сегодня ушли денежки, Иришка?",
     "Что оплатили? Давай выберем категорию.",
@@ -155,8 +289,8 @@ PH_EXP_CAT = [
     "На что записываем расход?",
     "Что купила? 🙂",
     "Куда улетели денежки? 🙂",
-]
-PH_EXP_SUB = [
+)
+PH_EXP_SUB = (
     "*{cat}*, а точнее?",
     "Понял(а). А внутри *{cat}* — что именно?",
     "Уточним: *{cat}* → какой пункт?",
@@ -167,8 +301,8 @@ PH_EXP_SUB = [
     "В *{cat}* какой раздел?",
     "Давай точнее в рамках *{cat}*.",
     "Что именно из *{cat}*?",
-]
-PH_AMOUNT_EXP = [
+)
+PH_AMOUNT_EXP = (
     "И сколько там?",
     "Какая сумма?",
     "На сколько вышло?",
@@ -179,8 +313,8 @@ PH_AMOUNT_EXP = [
     "Давай сумму.",
     "Сколько получилось?",
     "Ммм, и сколько там?",
-]
-PH_COMMENT_EXP = [
+)
+PH_COMMENT_EXP = (
     "Да норм, это недорого! Добавишь коммент?",
     "Коммент добавим или пропускаем?",
     "Хочешь уточнение для себя? (необязательно)",
@@ -191,8 +325,8 @@ PH_COMMENT_EXP = [
     "Есть что дописать? 🙂",
     "Добавишь пояснение? (не обязательно)",
     "Оставим заметку? (если хочешь)",
-]
-PH_SAVED_EXP = [
+)
+PH_SAVED_EXP = (
     "Всё понял, записал ✅",
     "Готово ✅ Зафиксировал.",
     "Записано ✅ Спасибо.",
@@ -203,8 +337,8 @@ PH_SAVED_EXP = [
     "Окей ✅ Записал.",
     "Отлично ✅ Внес.",
     "Готово ✅",
-]
-PH_INC_CAT = [
+)
+PH_INC_CAT = (
     "Опачки, денежки! И кто такой добрый?",
     "Ого! Доходик пришёл 🙂 От кого?",
     "Денежки пришли — записываем. Кто источник?",
@@ -215,8 +349,8 @@ PH_INC_CAT = [
     "Ну красота 🙂 Кто отправитель?",
     "Денежки прилетели. Откуда?",
     "Кто сегодня пополнил копилочку? 🙂",
-]
-PH_AMOUNT_INC = [
+)
+PH_AMOUNT_INC = (
     "Ммм, и сколько там?",
     "И сколько пришло?",
     "Какая сумма?",
@@ -227,8 +361,8 @@ PH_AMOUNT_INC = [
     "Давай сумму.",
     "Сколько получилось?",
     "Сколько там денежек?",
-]
-PH_COMMENT_INC = [
+)
+PH_COMMENT_INC = (
     "Нормально так! Коммент оставишь?",
     "Хочешь добавить коммент? (необязательно)",
     "Добавим уточнение? (можно пропустить)",
@@ -239,8 +373,8 @@ PH_COMMENT_INC = [
     "Добавишь пояснение?",
     "Коммент нужен?",
     "Есть что уточнить? 🙂",
-]
-PH_SAVED_INC = [
+)
+PH_SAVED_INC = (
     "Красотка, всё записал ✅",
     "Готово ✅ Записал поступление.",
     "Есть ✅ Сохранил.",
@@ -251,9 +385,49 @@ PH_SAVED_INC = [
     "Окей ✅ Всё занёс.",
     "Угу ✅ В таблице.",
     "Красота ✅",
-]
+)
+
+
+def _phrase_cycle(pool: Tuple[str, ...]) -> Iterator[str]:
+    # каждый круг — новая перестановка; на стыке кругов фраза не повторяется подряд
+    last = None
+    while True:
+        order = random.sample(pool, len(pool))
+        if len(order) > 1 and order[0] == last:
+            order[0], order[-1] = order[-1], order[0]
+        yield from order
+        last = order[-1]
+
+
+_PHRASES: Dict[Tuple[str, ...], Iterator[str]] = {
+    pool: _phrase_cycle(pool)
+    for pool in (
+        PH_EXP_CAT, PH_EXP_SUB, PH_AMOUNT_EXP, PH_COMMENT_EXP, PH_SAVED_EXP,
+        PH_INC_CAT, PH_AMOUNT_INC, PH_COMMENT_INC, PH_SAVED_INC,
+    )
+}
+
+
+def phrase(pool: Tuple[str, ...]) -> str:
+    return next(_PHRASES[pool])
+
 
 DENY_TEXT = "Извини, доступ только для Иришки 🙂"
+SAVE_FAILED_TEXT = "⚠️ Не получилось сохранить запись в таблицу 🙈 Попробуй внести её ещё раз."
+ERROR_TEXT = "Ой, что-то пошло не так 🙈 Попробуем ещё раз?"
+
+# значок типа записи в списке и карточке редактирования; всё, что не расход, — доход
+TYPE_EMOJI = {"расход": "➖", "доход": "➕"}
+
+# повторяющиеся подсказки
+ASK_TYPE_TEXT = "Окей 🙂 Что вносим?"
+ASK_ANALYSIS_KIND_TEXT = "Что посмотрим?"
+ASK_PERIOD_TEXT = "Окей 🙂 За какой период?"
+EDIT_LIST_TEXT = "<b>📝 Выбери запись для редактирования:</b>"
+AMOUNT_EXAMPLES = "\n\nПримеры: <code>2500</code>, <code>2 500</code>, <code>2.500</code>, <code>2500,50</code>, <code>2к</code>"
+BAD_AMOUNT_TX_TEXT = "Не понял сумму 🙈\nНапиши, пожалуйста, например: 2500 / 2 500 / 2500,50 / 2к"
+BAD_AMOUNT_BALANCE_TEXT = "Не понял сумму 🙈\nНапиши, пожалуйста, например: 50000 / 50 000 / 50к"
+BAD_AMOUNT_EDIT_TEXT = "Не понял сумму 🙈\nНапиши, пожалуйста, например: 2500 / 2 500 / 2к"
 
 
 # =========================
@@ -275,28 +449,150 @@ DENY_TEXT = "Извини, доступ только для Иришки 🙂"
     ST_EDIT_VALUE,
 ) = range(13)
 
+# callback_data паттерны — компилируем один раз
+PAT_MENU = re.compile(r"^menu:", re.ASCII)
+PAT_BACK = re.compile(r"^back:", re.ASCII)
+PAT_TYPE = re.compile(r"^type:", re.ASCII)
+PAT_EXP_CAT = re.compile(r"^expcat:\d+$", re.ASCII)
+PAT_EXP_SUB = re.compile(r"^expsub:\d+$", re.ASCII)
+PAT_INC_CAT = re.compile(r"^inccat:\d+$", re.ASCII)
+PAT_COMMENT_SKIP = re.compile(r"^comment:skip$", re.ASCII)
+PAT_AKIND = re.compile(r"^akind:", re.ASCII)
+PAT_APERIOD = re.compile(r"^aperiod:", re.ASCII)
+PAT_EDIT_ROW = re.compile(r"^edit_row:\d+$", re.ASCII)
+PAT_EDIT_FIELD = re.compile(r"^edit_field:", re.ASCII)
+
+# текстовый ввод без команд — один фильтр на все MessageHandler
+_TEXT_NOT_CMD = filters.TEXT & ~filters.COMMAND
+
 
 # =========================
 # Helpers
 # =========================
+async def _safe_delete(message: Message) -> None:
+    try:
+        await message.delete()
+    except Exception as e:
+        logger.debug("Couldn't delete message %s: %s", message.message_id, e)
+
+
+async def _safe_delete_by_id(context: ContextTypes.DEFAULT_TYPE, chat_id: int, msg_id: int) -> None:
+    try:
+        await context.bot.delete_message(chat_id=chat_id, message_id=msg_id)
+    except Exception as e:
+        logger.debug("Couldn't delete message %s: %s", msg_id, e)
+
+
 async def delete_working_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+    msg_id = context.user_data.get("working_message_id")
+    context.user_data["working_message_id"] = None
+    if msg_id:
+        await _safe_delete_by_id(context, chat_id, msg_id)
+
+
+def drop_working_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> None:
+    """Как delete_working_message, но удаление уходит в фон и ответ его не ждёт."""
+    msg_id = context.user_data.get("working_message_id")
+    context.user_data["working_message_id"] = None
+    if msg_id:
+        context.application.create_task(_safe_delete_by_id(context, chat_id, msg_id))
+
+
+async def show_working_message(
+    context: ContextTypes.DEFAULT_TYPE,
+    chat: Chat,
+    text: str,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+) -> None:
+    """Показать текст в рабочем сообщении: правим его на месте (один запрос вместо delete + send).
+    Если править нечего или правка не удалась — удаляем старое и шлём новое.
+    """
     msg_id = context.user_data.get("working_message_id")
     if msg_id:
         try:
-            await context.bot.delete_message(chat_id=chat_id, message_id=msg_id)
+            await context.bot.edit_message_text(
+                chat_id=chat.id, message_id=msg_id, text=text, reply_markup=reply_markup
+            )
+            return
+        except BadRequest as e:
+            # тот же текст уже на экране (повторная ошибка ввода) — всё и так как надо
+            if "not modified" in str(e).lower():
+                return
+            logger.debug("Couldn't edit message %s: %s", msg_id, e)
         except Exception as e:
-            logger.debug(f"Couldn't delete message {msg_id}: {e}")
-    context.user_data["working_message_id"] = None
+            logger.debug("Couldn't edit message %s: %s", msg_id, e)
+        drop_working_message(context, chat.id)
+    msg = await chat.send_message(text, reply_markup=reply_markup)
+    context.user_data["working_message_id"] = msg.message_id
+
+
+_FLOW_STATE_KEYS = (
+    "tx",
+    "edit_transactions",
+    "edit_transactions_by_row",
+    "edit_transactions_kb",
+    "selected_transaction",
+    "edit_field",
+    "analysis_kind",
+    "working_message_id",
+)
+
 
+def _clear_flow_state(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Сбросить состояние сценария, когда он закончился и мы вернулись в меню."""
+    for key in _FLOW_STATE_KEYS:
+        context.user_data.pop(key, None)
 
-def is_allowed(update: Update) -> bool:
+
+def is_allowed(update: Update, _wife_id: int = WIFE_TG_ID) -> bool:
     user = update.effective_user
-    return bool(user and user.id == WIFE_TG_ID)
+    return user is not None and user.id == _wife_id
+
+
+# [+] двойные нажатия: chat_id → (message_id, data, monotonic) последнего обработанного колбэка.
+# Апдейты обрабатываются по одному, поэтому время ставим, когда обработка закончилась:
+# дубль, простоявший в очереди за медленным запросом к GAS, тоже попадёт в окно
+_last_callback: Dict[int, Tuple[int, str, float]] = {}
+DOUBLE_TAP_WINDOW = 0.5
+
+
+async def drop_double_tap(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Повтор той же кнопки того же сообщения в течение DOUBLE_TAP_WINDOW — гасим до сценария."""
+    q = update.callback_query
+    if q.message is None:
+        return
+    last = _last_callback.get(q.message.chat.id)
+    if (
+        last
+        and last[0] == q.message.message_id
+        and last[1] == q.data
+        and time.monotonic() - last[2] < DOUBLE_TAP_WINDOW
+    ):
+        await q.answer()
+        raise ApplicationHandlerStop
+
+
+async def remember_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Запомнить колбэк после сценария; чужих не запоминаем — таблица не растёт."""
+    q = update.callback_query
+    if q.message is None or not is_allowed(update):
+        return
+    _last_callback[q.message.chat.id] = (q.message.message_id, q.data, time.monotonic())
+
+
+# Разделитель тысяч: "1,234.50" -> "1 234.50"
+_NUM_TRANS = str.maketrans(",", " ")
+
+
+def fmt_rub(amount: float) -> str:
+    return format(amount, ",.2f").translate(_NUM_TRANS)
 
 
 # =========================
 # Keyboards
 # =========================
+# Статичные клавиатуры собираются один раз и дальше переиспользуются.
+@functools.lru_cache(maxsize=None)
 def kb_main() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("➕ Внести транзакцию", callback_data="menu:add")],
@@ -306,6 +602,7 @@ def kb_main() -> InlineKeyboardMarkup:
     ])
 
 
+@functools.lru_cache(maxsize=None)
 def kb_choose_type() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("➖ Затраты", callback_data="type:expense")],
@@ -314,56 +611,43 @@ def kb_choose_type() -> InlineKeyboardMarkup:
     ])
 
 
+def _two_per_row(buttons: List[InlineKeyboardButton]) -> List[List[InlineKeyboardButton]]:
+    return [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+
+
+@functools.lru_cache(maxsize=None)
 def kb_expense_categories() -> InlineKeyboardMarkup:
-    cats = list(EXPENSES.keys())
-    rows = []
-    row = []
-    for i, c in enumerate(cats):
-        row.append(InlineKeyboardButton(c, callback_data=f"expcat:{i}"))
-        if len(row) == 2:
-            rows.append(row)
-            row = []
-    if row:
-        rows.append(row)
+    buttons = [InlineKeyboardButton(c, callback_data=f"expcat:{i}") for i, c in enumerate(EXPENSE_KEYS)]
+    rows = _two_per_row(buttons)
     rows.append([InlineKeyboardButton("⬅️ Назад", callback_data="back:choose_type")])
     return InlineKeyboardMarkup(rows)
 
 
+@functools.lru_cache(maxsize=None)
 def kb_expense_subcategories(cat: str) -> InlineKeyboardMarkup:
-    subs = EXPENSES.get(cat, [])
-    rows = []
-    row = []
-    for i, s in enumerate(subs):
-        row.append(InlineKeyboardButton(s, callback_data=f"expsub:{i}"))
-        if len(row) == 2:
-            rows.append(row)
-            row = []
-    if row:
-        rows.append(row)
+    subs = SUBS_BY_CAT.get(cat, ())
+    buttons = [InlineKeyboardButton(s, callback_data=f"expsub:{i}") for i, s in enumerate(subs)]
+    rows = _two_per_row(buttons)
     rows.append([InlineKeyboardButton("⬅️ Назад", callback_data="back:exp_cat")])
     return InlineKeyboardMarkup(rows)
 
 
+@functools.lru_cache(maxsize=None)
 def kb_income_categories() -> InlineKeyboardMarkup:
-    rows = []
-    row = []
-    for i, c in enumerate(INCOME_CATEGORIES):
-        row.append(InlineKeyboardButton(c, callback_data=f"inccat:{i}"))
-        if len(row) == 2:
-            rows.append(row)
-            row = []
-    if row:
-        rows.append(row)
+    buttons = [InlineKeyboardButton(c, callback_data=f"inccat:{i}") for i, c in enumerate(INCOME_CATEGORIES)]
+    rows = _two_per_row(buttons)
     rows.append([InlineKeyboardButton("⬅️ Назад", callback_data="back:choose_type")])
     return InlineKeyboardMarkup(rows)
 
 
+@functools.lru_cache(maxsize=None)
 def kb_skip_comment() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("Пропустить", callback_data="comment:skip")],
     ])
 
 
+@functools.lru_cache(maxsize=None)
 def kb_analysis_kind() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("➖ Затраты", callback_data="akind:expense")],
@@ -372,6 +656,7 @@ def kb_analysis_kind() -> InlineKeyboardMarkup:
     ])
 
 
+@functools.lru_cache(maxsize=None)
 def kb_analysis_period() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("Сегодня", callback_data="aperiod:today")],
@@ -387,15 +672,16 @@ def kb_edit_list(transactions: List[Dict]) -> InlineKeyboardMarkup:
         row_id = tx["row_id"]
         date_str = tx["date"][:10]
         tx_type = tx["type"]
-        emoji = "➖" if tx_type == "расход" else "➕"
+        emoji = TYPE_EMOJI.get(tx_type, "➕")
         cat = tx["category"]
         amt = tx["amount"]
-        label = f"{emoji} {date_str} | {cat} | {amt:,.0f} ₽".replace(",", " ")
+        label = f"{emoji} {date_str} | {cat} | {amt:,.0f} ₽".translate(_NUM_TRANS)
         rows.append([InlineKeyboardButton(label, callback_data=f"edit_row:{row_id}")])
     rows.append([InlineKeyboardButton("⬅️ Назад", callback_data="back:menu")])
     return InlineKeyboardMarkup(rows)
 
 
+@functools.lru_cache(maxsize=None)
 def kb_edit_field() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("💰 Изменить сумму", callback_data="edit_field:amount")],
@@ -408,31 +694,46 @@ def kb_edit_field() -> InlineKeyboardMarkup:
 # =========================
 # Amount parsing
 # =========================
+_PUNCT_STRIP = str.maketrans("", "", ".,")
+
+
+class _NumericOnly(dict):
+    """Таблица для str.translate: цифры, точка и минус остаются, всё остальное (включая ₽ и буквы) удаляется."""
+
+    def __missing__(self, key: int) -> None:
+        return None
+
+
+_NUMERIC_ONLY = _NumericOnly((ord(c), c) for c in "0123456789.-")
+
+
+# чистая функция от строки; одни и те же суммы вводятся постоянно
+@functools.lru_cache(maxsize=256)
 def parse_amount(text: str) -> Optional[float]:
     if not text:
         return None
-    s0 = text.strip().lower()
+    # str.split() без аргументов режет по любым пробельным символам (включая NBSP)
+    s = "".join(text.split())
+    # быстрый путь: целое число без разделителей ("2500", "2 500")
+    if s.isascii() and s.isdigit():
+        return float(s)
+    s = s.lower()
 
     mult = 1.0
-    s = re.sub(r"\s+", "", s0)
     if s.endswith("к") or s.endswith("k"):
         mult = 1000.0
         s = s[:-1]
 
-    has_comma = "," in s
-    has_dot = "." in s
+    last_comma = s.rfind(",")
+    last_dot = s.rfind(".")
 
-    if has_comma and has_dot:
-        last_comma = s.rfind(",")
-        last_dot = s.rfind(".")
+    if last_comma >= 0 and last_dot >= 0:
         dec_pos = max(last_comma, last_dot)
-        int_part = re.sub(r"[.,]", "", s[:dec_pos])
-        frac_part = re.sub(r"[.,]", "", s[dec_pos + 1:])
-        s = f"{int_part}.{frac_part}"
-    elif has_comma and not has_dot:
+        s = s[:dec_pos].translate(_PUNCT_STRIP) + "." + s[dec_pos + 1:].translate(_PUNCT_STRIP)
+    elif last_comma >= 0:
         s = s.replace(",", ".")
 
-    s = re.sub(r"[^0-9.\-]", "", s)
+    s = s.translate(_NUMERIC_ONLY)
     try:
         val = float(s) * mult
         if val < 0:
@@ -445,51 +746,68 @@ def parse_amount(text: str) -> Optional[float]:
 # =========================
 # GAS API  [+] persistent session + logging
 # =========================
+# команды записи: GAS может вернуть в ответе свежую сводку месяца ("month_summary")
+_WRITE_CMDS = frozenset({"add", "set_balance", "update_transaction", "delete_transaction"})
+
+
 async def gas_request(payload: Dict[str, Any]) -> Dict[str, Any]:
-    payload = dict(payload)
-    payload["user_id"] = WIFE_TG_ID
+    """Вызов GAS. payload переходит во владение функции: в него дописывается user_id."""
     cmd = payload.get("cmd", "?")
-    logger.info("GAS >> cmd=%s %s", cmd, {k: v for k, v in payload.items() if k != "user_id"})
+    payload["user_id"] = WIFE_TG_ID
+    if logger.isEnabledFor(logging.INFO):
+        # копию payload без user_id собираем, только если строка реально попадёт в лог
+        logger.info("GAS >> cmd=%s %s", cmd, {k: v for k, v in payload.items() if k != "user_id"})
 
     session = await get_http_session()
-    async with session.post(SCRIPT_URL, json=payload) as resp:
-        txt = await resp.text()
-        logger.info("GAS << cmd=%s status=%s body=%.400s", cmd, resp.status, txt)
+    async with session.post(SCRIPT_URL, data=orjson.dumps(payload)) as resp:
+        raw = await resp.read()
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("GAS << cmd=%s status=%s body=%s", cmd, resp.status, raw[:400].decode("utf-8", "replace"))
         try:
-            data = await resp.json(content_type=None)
-        except Exception:
-            logger.error("GAS non-json response: %s", txt)
+            data = orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            logger.error("GAS non-json response: %s", raw[:512].decode("utf-8", "replace"))
             raise RuntimeError("GAS вернул не-JSON ответ")
         if not data.get("ok"):
             raise RuntimeError(data.get("error") or "GAS error")
-        return data["data"]
+        result = data["data"]
+        if cmd in _WRITE_CMDS:
+            # запись уже в таблице: всё, что прочитали (или читают) пока она шла, — старое
+            _invalidate_caches()
+            # [+] сводка пришла вместе с записью — кладём в кэш, отдельный summary_month не нужен
+            summary = result.get("month_summary") if isinstance(result, dict) else None
+            if isinstance(summary, dict):
+                _store_month_summary(summary)
+        return result
+
+
+_MONTH_TMPL = (
+    "<b>{month}</b>\n"
+    "💰 Начальный баланс: <b>{init_bal:,.2f}</b> ₽\n"
+    "➖ Расходы: <b>{exp:,.2f}</b> ₽\n"
+    "➕ Доходы: <b>{inc:,.2f}</b> ₽\n"
+    "🟰 За месяц: <b>{bal:,.2f}</b> ₽\n"
+    "💵 Текущий баланс: <b>{curr_bal:,.2f}</b> ₽"
+)
+
+
+def _render_month(s: Dict[str, Any]) -> str:
+    return _MONTH_TMPL.format(
+        month=s.get("month_label", "Текущий месяц"),
+        init_bal=s.get("initial_balance", 0.0),
+        exp=s.get("expenses", 0.0),
+        inc=s.get("incomes", 0.0),
+        bal=s.get("balance", 0.0),
+        curr_bal=s.get("current_balance", 0.0),
+    ).translate(_NUM_TRANS)
 
 
 async def month_screen_text() -> str:
-    # [+] cache
-    now = time.monotonic()
-    if _month_cache.get("ts") and now - _month_cache["ts"] < CACHE_TTL:
-        s = _month_cache["data"]
-    else:
-        s = await gas_request({"cmd": "summary_month"})
-        _month_cache["data"] = s
-        _month_cache["ts"] = now
-
-    month = s.get("month_label", "Текущий месяц")
-    exp = s.get("expenses", 0)
-    inc = s.get("incomes", 0)
-    bal = s.get("balance", 0)
-    init_bal = s.get("initial_balance", 0)
-    curr_bal = s.get("current_balance", 0)
-
-    return (
-        f"<b>{month}</b>\n"
-        f"💰 Начальный баланс: <b>{init_bal:,.2f}</b> ₽\n"
-        f"➖ Расходы: <b>{exp:,.2f}</b> ₽\n"
-        f"➕ Доходы: <b>{inc:,.2f}</b> ₽\n"
-        f"🟰 За месяц: <b>{bal:,.2f}</b> ₽\n"
-        f"💵 Текущий баланс: <b>{curr_bal:,.2f}</b> ₽"
-    ).replace(",", " ")
+    s = await _fetch_month_summary()
+    if _month_cache.data is s:
+        return _month_cache.html
+    # ответ не попал в кэш (была запись во время запроса) — рендерим как есть
+    return _render_month(s)
 
 
 # =========================
@@ -503,11 +821,70 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
 
     txt = await month_screen_text()
-    await update.message.reply_text(txt, reply_markup=kb_main(), parse_mode=ParseMode.HTML)
+    await update.message.reply_text(txt, reply_markup=kb_main())
 
     return ST_MENU
 
 
+async def _menu_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.edit_message_text(ASK_TYPE_TEXT, reply_markup=kb_choose_type())
+    context.user_data["working_message_id"] = q.message.message_id
+    return ST_ADD_CHOOSE_TYPE
+
+
+_EDIT_KEEP_KEYS = ("row_id", "type", "date", "category", "subcategory", "amount", "comment")
+
+
+async def _menu_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    result = await cached_gas_request({"cmd": "get_recent_transactions", "limit": RECENT_TX_LIMIT})
+    # в user_data держим только нужные поля (и свои копии — ответ из кэша не трогаем)
+    transactions = [
+        {k: tx[k] for k in _EDIT_KEEP_KEYS if k in tx}
+        for tx in result.get("transactions", [])
+    ]
+
+    if not transactions:
+        await q.answer("Нет записей для редактирования", show_alert=True)
+        return ST_MENU
+
+    markup = kb_edit_list(transactions)
+    await q.edit_message_text(EDIT_LIST_TEXT, reply_markup=markup)
+    context.user_data["working_message_id"] = q.message.message_id
+    context.user_data["edit_transactions"] = transactions
+    # список не меняется до следующего входа в меню — кнопки переиспользуем при "Назад"
+    context.user_data["edit_transactions_kb"] = markup
+    context.user_data["edit_transactions_by_row"] = _index_transactions(transactions)
+    return ST_EDIT_SELECT
+
+
+async def _menu_analysis(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.edit_message_text(ASK_ANALYSIS_KIND_TEXT, reply_markup=kb_analysis_kind())
+    context.user_data["working_message_id"] = q.message.message_id
+    return ST_ANALYSIS_KIND
+
+
+async def _menu_set_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.edit_message_text(
+        "Какой у тебя сейчас баланс? 💰\n\n"
+        "Напиши сумму (например: 50000 или 50к)"
+    )
+    context.user_data["working_message_id"] = q.message.message_id
+    return ST_SET_BALANCE
+
+
+# menu:<action> → обработчик
+_MENU_ACTIONS = {
+    "add": _menu_add,
+    "edit": _menu_edit,
+    "analysis": _menu_analysis,
+    "set_balance": _menu_set_balance,
+}
+
+
 async def on_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_allowed(update):
         await update.callback_query.answer()
@@ -517,77 +894,78 @@ async def on_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
-    if q.data == "menu:add":
-        await q.edit_message_text("Окей 🙂 Что вносим?", reply_markup=kb_choose_type())
-        context.user_data["working_message_id"] = q.message.message_id
-        return ST_ADD_CHOOSE_TYPE
+    action = _MENU_ACTIONS.get(q.data.partition(":")[2])
+    if action is None:
+        return ST_MENU
+    return await action(update, context)
 
-    if q.data == "menu:edit":
-        result = await gas_request({"cmd": "get_recent_transactions", "limit": 5})
-        transactions = result.get("transactions", [])
 
-        if not transactions:
-            await q.answer("Нет записей для редактирования", show_alert=True)
-            return ST_MENU
+def _index_transactions(transactions: List[Dict]) -> Dict[int, Dict]:
+    """row_id → запись; строки для карточки записи считаем один раз при загрузке."""
+    by_row = {}
+    for tx in transactions:
+        tx["_display_date"] = tx["date"][:16]
+        tx["_fmt_amount"] = fmt_rub(tx["amount"])
+        by_row[tx["row_id"]] = tx
+    return by_row
 
-        await q.edit_message_text(
-            "<b>📝 Выбери запись для редактирования:</b>",
-            reply_markup=kb_edit_list(transactions),
-            parse_mode=ParseMode.HTML
-        )
-        context.user_data["working_message_id"] = q.message.message_id
-        context.user_data["edit_transactions"] = transactions
-        return ST_EDIT_SELECT
 
-    if q.data == "menu:analysis":
-        await q.edit_message_text("Что посмотрим?", reply_markup=kb_analysis_kind())
-        context.user_data["working_message_id"] = q.message.message_id
-        return ST_ANALYSIS_KIND
+async def _back_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # кнопка "Назад" стоит на рабочем сообщении — превращаем его обратно в главный экран
+    txt = await month_screen_text()
+    await show_working_message(context, update.effective_chat, txt, reply_markup=kb_main())
+    _clear_flow_state(context)
+    return ST_MENU
 
-    if q.data == "menu:set_balance":
-        await q.edit_message_text(
-            "Какой у тебя сейчас баланс? 💰\n\n"
-            "Напиши сумму (например: 50000 или 50к)",
-            parse_mode=ParseMode.HTML
-        )
-        context.user_data["working_message_id"] = q.message.message_id
-        return ST_SET_BALANCE
 
-    return ST_MENU
+async def _back_choose_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text(ASK_TYPE_TEXT, reply_markup=kb_choose_type())
+    return ST_ADD_CHOOSE_TYPE
+
+
+async def _back_exp_cat(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text(phrase(PH_EXP_CAT), reply_markup=kb_expense_categories())
+    return ST_EXP_CATEGORY
+
+
+async def _back_analysis_kind(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text(ASK_ANALYSIS_KIND_TEXT, reply_markup=kb_analysis_kind())
+    return ST_ANALYSIS_KIND
+
+
+async def _back_edit_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    markup = context.user_data.get("edit_transactions_kb")
+    if markup is None:
+        markup = kb_edit_list(context.user_data.get("edit_transactions", []))
+    await update.callback_query.edit_message_text(EDIT_LIST_TEXT, reply_markup=markup)
+    return ST_EDIT_SELECT
+
+
+# back:<dest> → обработчик
+_BACK_ACTIONS = {
+    "menu": _back_menu,
+    "choose_type": _back_choose_type,
+    "exp_cat": _back_exp_cat,
+    "analysis_kind": _back_analysis_kind,
+    "edit_list": _back_edit_list,
+}
 
 
 async def back_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
-    if q.data == "back:menu":
-        await delete_working_message(context, update.effective_chat.id)
-        txt = await month_screen_text()
-        await update.effective_chat.send_message(txt, reply_markup=kb_main(), parse_mode=ParseMode.HTML)
+    action = _BACK_ACTIONS.get(q.data.partition(":")[2])
+    if action is None:
         return ST_MENU
+    return await action(update, context)
 
-    if q.data == "back:choose_type":
-        await q.edit_message_text("Окей 🙂 Что вносим?", reply_markup=kb_choose_type())
-        return ST_ADD_CHOOSE_TYPE
-
-    if q.data == "back:exp_cat":
-        await q.edit_message_text(random.choice(PH_EXP_CAT), reply_markup=kb_expense_categories())
-        return ST_EXP_CATEGORY
-
-    if q.data == "back:analysis_kind":
-        await q.edit_message_text("Что посмотрим?", reply_markup=kb_analysis_kind())
-        return ST_ANALYSIS_KIND
 
-    if q.data == "back:edit_list":
-        transactions = context.user_data.get("edit_transactions", [])
-        await q.edit_message_text(
-            "<b>📝 Выбери запись для редактирования:</b>",
-            reply_markup=kb_edit_list(transactions),
-            parse_mode=ParseMode.HTML
-        )
-        return ST_EDIT_SELECT
-
-    return ST_MENU
+# type:<kind> → (пул фраз, клавиатура категорий, следующее состояние)
+_TYPE_SCREENS = {
+    "expense": (PH_EXP_CAT, kb_expense_categories, ST_EXP_CATEGORY),
+    "income": (PH_INC_CAT, kb_income_categories, ST_INC_CATEGORY),
+}
 
 
 async def choose_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -597,31 +975,27 @@ async def choose_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.pop("tx", None)
     context.user_data["tx"] = {}
 
-    if q.data == "type:expense":
-        await q.edit_message_text(random.choice(PH_EXP_CAT), reply_markup=kb_expense_categories())
-        return ST_EXP_CATEGORY
-
-    if q.data == "type:income":
-        await q.edit_message_text(random.choice(PH_INC_CAT), reply_markup=kb_income_categories())
-        return ST_INC_CATEGORY
+    screen = _TYPE_SCREENS.get(q.data.partition(":")[2])
+    if screen is None:
+        return ST_ADD_CHOOSE_TYPE
 
-    return ST_ADD_CHOOSE_TYPE
+    pool, kb, state = screen
+    await q.edit_message_text(phrase(pool), reply_markup=kb())
+    return state
 
 
 async def expense_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
-    cats = list(EXPENSES.keys())
-    idx = int(q.data.split(":")[1])
-    cat = cats[idx]
+    idx = int(q.data.partition(":")[2])
+    cat = EXPENSE_KEYS[idx]
 
-    tx = context.user_data.get("tx", {})
+    tx = context.user_data.setdefault("tx", {})
     tx["type"] = "расход"
     tx["category"] = cat
-    context.user_data["tx"] = tx
 
-    msg = random.choice(PH_EXP_SUB).format(cat=cat)
+    msg = phrase(PH_EXP_SUB).format(cat=cat)
     await q.edit_message_text(msg, reply_markup=kb_expense_subcategories(cat), parse_mode=ParseMode.MARKDOWN)
     return ST_EXP_SUBCATEGORY
 
@@ -630,17 +1004,16 @@ async def expense_subcategory(update: Update, context: ContextTypes.DEFAULT_TYPE
     q = update.callback_query
     await q.answer()
 
-    tx = context.user_data.get("tx", {})
+    tx = context.user_data.setdefault("tx", {})
     cat = tx.get("category", "")
-    subs = EXPENSES.get(cat, [])
-    idx = int(q.data.split(":")[1])
+    subs = SUBS_BY_CAT.get(cat, ())
+    idx = int(q.data.partition(":")[2])
     sub = subs[idx] if 0 <= idx < len(subs) else ""
 
     tx["subcategory"] = sub
-    context.user_data["tx"] = tx
 
-    prompt = random.choice(PH_AMOUNT_EXP) + "\n\nПримеры: <code>2500</code>, <code>2 500</code>, <code>2.500</code>, <code>2500,50</code>, <code>2к</code>"
-    await q.edit_message_text(prompt, parse_mode=ParseMode.HTML)
+    prompt = phrase(PH_AMOUNT_EXP) + AMOUNT_EXAMPLES
+    await q.edit_message_text(prompt)
     return ST_AMOUNT
 
 
@@ -648,17 +1021,16 @@ async def income_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
-    idx = int(q.data.split(":")[1])
+    idx = int(q.data.partition(":")[2])
     cat = INCOME_CATEGORIES[idx]
 
-    tx = context.user_data.get("tx", {})
+    tx = context.user_data.setdefault("tx", {})
     tx["type"] = "доход"
     tx["category"] = cat
     tx["subcategory"] = ""
-    context.user_data["tx"] = tx
 
-    prompt = random.choice(PH_AMOUNT_INC) + "\n\nПримеры: <code>2500</code>, <code>2 500</code>, <code>2.500</code>, <code>2500,50</code>, <code>2к</code>"
-    await q.edit_message_text(prompt, parse_mode=ParseMode.HTML)
+    prompt = phrase(PH_AMOUNT_INC) + AMOUNT_EXAMPLES
+    await q.edit_message_text(prompt)
     return ST_AMOUNT
 
 
@@ -669,27 +1041,19 @@ async def amount_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     amt = parse_amount(update.message.text)
 
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    context.application.create_task(_safe_delete(update.message))
 
     if amt is None:
-        await delete_working_message(context, update.effective_chat.id)
-        msg = await update.effective_chat.send_message(
-            "Не понял сумму 🙈\nНапиши, пожалуйста, например: 2500 / 2 500 / 2500,50 / 2к"
-        )
-        context.user_data["working_message_id"] = msg.message_id
+        await show_working_message(context, update.effective_chat, BAD_AMOUNT_TX_TEXT)
         return ST_AMOUNT
 
-    tx = context.user_data.get("tx", {})
+    tx = context.user_data.setdefault("tx", {})
     tx["amount"] = amt
-    context.user_data["tx"] = tx
 
     work_msg_id = context.user_data.get("working_message_id")
     if work_msg_id:
         try:
-            text = random.choice(PH_COMMENT_EXP) if tx.get("type") == "расход" else random.choice(PH_COMMENT_INC)
+            text = phrase(PH_COMMENT_EXP) if tx.get("type") == "расход" else phrase(PH_COMMENT_INC)
             await context.bot.edit_message_text(
                 chat_id=update.effective_chat.id,
                 message_id=work_msg_id,
@@ -706,9 +1070,8 @@ async def comment_skip(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
-    tx = context.user_data.get("tx", {})
+    tx = context.user_data.setdefault("tx", {})
     tx["comment"] = ""
-    context.user_data["tx"] = tx
 
     await save_and_finish_(update, context)
     return ST_MENU
@@ -719,25 +1082,62 @@ async def comment_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(DENY_TEXT)
         return ConversationHandler.END
 
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    context.application.create_task(_safe_delete(update.message))
 
-    tx = context.user_data.get("tx", {})
+    tx = context.user_data.setdefault("tx", {})
     tx["comment"] = (update.message.text or "").strip()
-    context.user_data["tx"] = tx
 
     await save_and_finish_(update, context)
     return ST_MENU
 
 
+async def _month_text_after(write: asyncio.Task) -> str:
+    # сводку читаем только после записи, иначе в кэш попадут старые итоги
+    try:
+        await write
+    except Exception:
+        pass
+    return await month_screen_text()
+
+
+async def _post_save_followup(
+    chat: Chat, confirm_msg: Message, write: asyncio.Task, month: asyncio.Task
+) -> None:
+    # хвост сохранения: подтверждение висит 2 сек, затем предупреждение об ошибке записи и главный экран
+    try:
+        await asyncio.sleep(2)
+        await _safe_delete(confirm_msg)
+
+        try:
+            await write
+        except Exception as e:
+            logger.error("GAS add failed: %s", e)
+            await chat.send_message(SAVE_FAILED_TEXT)
+
+        txt_month = await month
+        await chat.send_message(txt_month, reply_markup=kb_main())
+    except Exception:
+        # задача без апдейта: error_handler пользователю ничего не пошлёт — отвечаем сами
+        logger.exception("Post-save follow-up failed")
+        try:
+            await chat.send_message(ERROR_TEXT)
+        except Exception:
+            pass
+    finally:
+        # month разбираем всегда, иначе asyncio напишет "Task exception was never retrieved"
+        if not month.done():
+            month.cancel()
+        elif not month.cancelled():
+            month.exception()
+
+
 async def save_and_finish_(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Сохранить транзакцию.
     [+] UX: удаляем рабочее сообщение → показываем 'Записано' → удаляем через 2 сек → главный экран.
+    Запись в GAS идёт параллельно с подтверждением; если она не прошла — предупреждаем отдельным сообщением.
+    Пауза с подтверждением, ожидание записи и главный экран досылаются фоновой задачей,
+    хендлер не держит очередь апдейтов.
     """
-    await delete_working_message(context, update.effective_chat.id)
-
     tx = context.user_data.get("tx", {})
     payload = {
         "cmd": "add",
@@ -749,75 +1149,76 @@ async def save_and_finish_(update: Update, context: ContextTypes.DEFAULT_TYPE):
     }
 
     # [+] инвалидируем кэш перед записью
-    _invalidate_month_cache()
+    _invalidate_caches()
 
-    await gas_request(payload)
+    drop_working_message(context, update.effective_chat.id)
+    # запись и сводка месяца идут в фоне, пока висит подтверждение
+    save_task = asyncio.create_task(gas_request(payload))
+    month_task = asyncio.create_task(_month_text_after(save_task))
 
     if tx.get("type") == "расход":
-        header = random.choice(PH_SAVED_EXP)
-        detail = f"{tx.get('category')} → {tx.get('subcategory')} — {tx.get('amount'):,.2f} ₽".replace(",", " ")
+        lines = [
+            phrase(PH_SAVED_EXP),
+            f"{tx.get('category')} → {tx.get('subcategory')} — {fmt_rub(tx.get('amount'))} ₽",
+        ]
     else:
-        header = random.choice(PH_SAVED_INC)
-        detail = f"{tx.get('category')} — {tx.get('amount'):,.2f} ₽".replace(",", " ")
+        lines = [
+            phrase(PH_SAVED_INC),
+            f"{tx.get('category')} — {fmt_rub(tx.get('amount'))} ₽",
+        ]
 
     comment = tx.get("comment", "").strip()
     if comment:
-        detail += f"\nКоммент: {comment}"
+        lines.append(f"Коммент: {html.escape(comment)}")
 
-    # [+] Показываем "Записано", через 2 сек удаляем, потом главный экран
-    confirm_msg = await update.effective_chat.send_message(f"{header}\n{detail}")
-    await asyncio.sleep(2)
-    try:
-        await confirm_msg.delete()
-    except Exception:
-        pass
+    # [+] Показываем "Записано"; удаление через 2 сек и главный экран — в фоне
+    confirm_msg = await update.effective_chat.send_message("\n".join(lines))
 
-    txt_month = await month_screen_text()
-    await update.effective_chat.send_message(
-        txt_month,
-        reply_markup=kb_main(),
-        parse_mode=ParseMode.HTML
+    _clear_flow_state(context)
+    context.application.create_task(
+        _post_save_followup(update.effective_chat, confirm_msg, save_task, month_task)
     )
 
 
+# akind:<kind> → тип операции в GAS
+_ANALYSIS_KINDS = {"expense": "расход", "income": "доход"}
+
+
 async def analysis_kind(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
-    if q.data == "akind:expense":
-        context.user_data["analysis_kind"] = "расход"
-        await q.edit_message_text("Окей 🙂 За какой период?", reply_markup=kb_analysis_period())
-        return ST_ANALYSIS_PERIOD
+    kind = _ANALYSIS_KINDS.get(q.data.partition(":")[2])
+    if kind is None:
+        return ST_ANALYSIS_KIND
 
-    if q.data == "akind:income":
-        context.user_data["analysis_kind"] = "доход"
-        await q.edit_message_text("Окей 🙂 За какой период?", reply_markup=kb_analysis_period())
-        return ST_ANALYSIS_PERIOD
-
-    return ST_ANALYSIS_KIND
+    context.user_data["analysis_kind"] = kind
+    await q.edit_message_text(ASK_PERIOD_TEXT, reply_markup=kb_analysis_period())
+    return ST_ANALYSIS_PERIOD
 
 
 async def analysis_period(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
-    period = q.data.split(":")[1]
+    period = q.data.partition(":")[2]
     kind = context.user_data.get("analysis_kind", "расход")
 
-    res = await gas_request({"cmd": "analysis", "kind": kind, "period": period})
+    res, txt = await asyncio.gather(
+        cached_gas_request({"cmd": "analysis", "kind": kind, "period": period}),
+        month_screen_text(),
+    )
 
     label_map = {"today": "Сегодня", "month": "В этом месяце", "year": "В этом году"}
     kind_label = "Затраты" if kind == "расход" else "Доходы"
 
     total = res.get("total", 0)
-    text = f"<b>{kind_label}</b> — <b>{label_map.get(period, period)}</b>\nСумма: <b>{total:,.2f}</b> ₽"
-    text = text.replace(",", " ")
+    text = f"<b>{kind_label}</b> — <b>{label_map.get(period, period)}</b>\nСумма: <b>{fmt_rub(total)}</b> ₽"
 
     await delete_working_message(context, update.effective_chat.id)
-    await update.effective_chat.send_message(text, parse_mode=ParseMode.HTML)
-
-    txt = await month_screen_text()
-    await update.effective_chat.send_message(txt, reply_markup=kb_main(), parse_mode=ParseMode.HTML)
+    _clear_flow_state(context)
+    await update.effective_chat.send_message(text)
+    await update.effective_chat.send_message(txt, reply_markup=kb_main())
 
     return ST_MENU
 
@@ -827,33 +1228,27 @@ async def set_balance_received(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text(DENY_TEXT)
         return ConversationHandler.END
 
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    context.application.create_task(_safe_delete(update.message))
 
     amt = parse_amount(update.message.text)
     if amt is None or amt < 0:
-        await delete_working_message(context, update.effective_chat.id)
-        msg = await update.effective_chat.send_message(
-            "Не понял сумму 🙈\nНапиши, пожалуйста, например: 50000 / 50 000 / 50к"
-        )
-        context.user_data["working_message_id"] = msg.message_id
+        await show_working_message(context, update.effective_chat, BAD_AMOUNT_BALANCE_TEXT)
         return ST_SET_BALANCE
 
     # [+] инвалидируем кэш
-    _invalidate_month_cache()
+    _invalidate_caches()
 
     await gas_request({"cmd": "set_balance", "amount": amt})
 
-    await delete_working_message(context, update.effective_chat.id)
-    await update.effective_chat.send_message(
-        f"Отлично! ✅ Начальный баланс установлен: <b>{amt:,.2f}</b> ₽".replace(",", " "),
-        parse_mode=ParseMode.HTML
+    drop_working_message(context, update.effective_chat.id)
+    _clear_flow_state(context)
+    _, txt = await asyncio.gather(
+        update.effective_chat.send_message(
+            f"Отлично! ✅ Начальный баланс установлен: <b>{fmt_rub(amt)}</b> ₽"
+        ),
+        month_screen_text(),
     )
-
-    txt = await month_screen_text()
-    await update.effective_chat.send_message(txt, reply_markup=kb_main(), parse_mode=ParseMode.HTML)
+    await update.effective_chat.send_message(txt, reply_markup=kb_main())
 
     return ST_MENU
 
@@ -865,15 +1260,9 @@ async def edit_select_row(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
-    row_id = int(q.data.split(":")[1])
-
-    transactions = context.user_data.get("edit_transactions", [])
-    selected_tx = None
-    for tx in transactions:
-        if tx["row_id"] == row_id:
-            selected_tx = tx
-            break
+    row_id = int(q.data.partition(":")[2])
 
+    selected_tx = context.user_data.get("edit_transactions_by_row", {}).get(row_id)
     if not selected_tx:
         await q.answer("Ошибка: запись не найдена", show_alert=True)
         return ST_EDIT_SELECT
@@ -881,27 +1270,25 @@ async def edit_select_row(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["selected_transaction"] = selected_tx
 
     tx_type = selected_tx["type"]
-    emoji = "➖" if tx_type == "расход" else "➕"
-    date_str = selected_tx["date"][:16]
-    cat = selected_tx["category"]
-    subcat = selected_tx.get("subcategory", "")
-    amt = selected_tx["amount"]
-    comment = selected_tx.get("comment", "")
-
-    text = (
-        f"<b>{emoji} {tx_type.capitalize()}</b>\n"
-        f"📅 {date_str}\n"
-        f"📂 {cat}"
-    )
-    if subcat:
-        text += f" → {subcat}"
-    text += f"\n💰 {amt:,.2f} ₽".replace(",", " ")
+    emoji = TYPE_EMOJI.get(tx_type, "➕")
+    date_str = selected_tx["_display_date"]
+    cat = html.escape(selected_tx["category"])
+    subcat = html.escape(selected_tx.get("subcategory", ""))
+    comment = html.escape(str(selected_tx.get("comment", "")))
+
+    lines = [
+        f"<b>{emoji} {tx_type.capitalize()}</b>",
+        f"📅 {date_str}",
+        f"📂 {cat} → {subcat}" if subcat else f"📂 {cat}",
+        f"💰 {selected_tx['_fmt_amount']} ₽",
+    ]
     if comment:
-        text += f"\n💬 {comment}"
+        lines.append(f"💬 {comment}")
+    lines.append("")
+    lines.append("<b>Что хочешь изменить?</b>")
+    text = "\n".join(lines)
 
-    text += "\n\n<b>Что хочешь изменить?</b>"
-
-    await q.edit_message_text(text, reply_markup=kb_edit_field(), parse_mode=ParseMode.HTML)
+    await q.edit_message_text(text, reply_markup=kb_edit_field())
     return ST_EDIT_FIELD
 
 
@@ -909,30 +1296,31 @@ async def edit_field_selected(update: Update, context: ContextTypes.DEFAULT_TYPE
     q = update.callback_query
     await q.answer()
 
-    field = q.data.split(":")[1]
+    field = q.data.partition(":")[2]
     context.user_data["edit_field"] = field
 
     selected_tx = context.user_data.get("selected_transaction", {})
 
     if field == "delete":
         row_id = selected_tx["row_id"]
-        _invalidate_month_cache()
+        _invalidate_caches()
         await gas_request({"cmd": "delete_transaction", "row_id": row_id})
 
         await delete_working_message(context, update.effective_chat.id)
-        await update.effective_chat.send_message("✅ Запись удалена")
-
-        txt = await month_screen_text()
-        await update.effective_chat.send_message(txt, reply_markup=kb_main(), parse_mode=ParseMode.HTML)
+        _clear_flow_state(context)
+        _, txt = await asyncio.gather(
+            update.effective_chat.send_message("✅ Запись удалена"),
+            month_screen_text(),
+        )
+        await update.effective_chat.send_message(txt, reply_markup=kb_main())
         return ST_MENU
 
     elif field == "amount":
         current_amt = selected_tx.get("amount", 0)
         await q.edit_message_text(
-            f"Текущая сумма: <b>{current_amt:,.2f}</b> ₽\n\n"
-            f"Введи новую сумму:\n"
-            f"(например: 2500 / 2 500 / 2к)".replace(",", " "),
-            parse_mode=ParseMode.HTML
+            f"Текущая сумма: <b>{fmt_rub(current_amt)}</b> ₽\n\n"
+            "Введи новую сумму:\n"
+            "(например: 2500 / 2 500 / 2к)"
         )
         return ST_EDIT_VALUE
 
@@ -940,12 +1328,12 @@ async def edit_field_selected(update: Update, context: ContextTypes.DEFAULT_TYPE
         current_comment = selected_tx.get("comment", "")
         text = "Текущий комментарий: "
         if current_comment:
-            text += f"<i>{current_comment}</i>"
+            text += f"<i>{html.escape(str(current_comment))}</i>"
         else:
             text += "<i>(пусто)</i>"
         text += "\n\nВведи новый комментарий:"
 
-        await q.edit_message_text(text, parse_mode=ParseMode.HTML)
+        await q.edit_message_text(text)
         return ST_EDIT_VALUE
 
     return ST_EDIT_FIELD
@@ -956,43 +1344,44 @@ async def edit_value_received(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text(DENY_TEXT)
         return ConversationHandler.END
 
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    context.application.create_task(_safe_delete(update.message))
 
     field = context.user_data.get("edit_field")
     selected_tx = context.user_data.get("selected_transaction", {})
     row_id = selected_tx["row_id"]
+    done_text: Optional[str] = None
 
     if field == "amount":
         amt = parse_amount(update.message.text)
         if amt is None or amt <= 0:
-            await delete_working_message(context, update.effective_chat.id)
-            msg = await update.effective_chat.send_message(
-                "Не понял сумму 🙈\nНапиши, пожалуйста, например: 2500 / 2 500 / 2к"
-            )
-            context.user_data["working_message_id"] = msg.message_id
+            await show_working_message(context, update.effective_chat, BAD_AMOUNT_EDIT_TEXT)
             return ST_EDIT_VALUE
 
-        _invalidate_month_cache()
+        _invalidate_caches()
         await gas_request({"cmd": "update_transaction", "row_id": row_id, "field": "amount", "value": amt})
 
-        await delete_working_message(context, update.effective_chat.id)
-        await update.effective_chat.send_message(
-            f"✅ Сумма изменена на <b>{amt:,.2f}</b> ₽".replace(",", " "),
-            parse_mode=ParseMode.HTML
-        )
+        drop_working_message(context, update.effective_chat.id)
+        done_text = f"✅ Сумма изменена на <b>{fmt_rub(amt)}</b> ₽"
 
     elif field == "comment":
         comment = (update.message.text or "").strip()
+        # итоги месяца не меняются, но список записей в кэше — уже устарел
+        _invalidate_caches()
         await gas_request({"cmd": "update_transaction", "row_id": row_id, "field": "comment", "value": comment})
 
-        await delete_working_message(context, update.effective_chat.id)
-        await update.effective_chat.send_message("✅ Комментарий изменен")
+        drop_working_message(context, update.effective_chat.id)
+        done_text = "✅ Комментарий изменен"
 
-    txt = await month_screen_text()
-    await update.effective_chat.send_message(txt, reply_markup=kb_main(), parse_mode=ParseMode.HTML)
+    _clear_flow_state(context)
+    # подтверждение и сводка месяца — параллельно
+    if done_text:
+        _, txt = await asyncio.gather(
+            update.effective_chat.send_message(done_text),
+            month_screen_text(),
+        )
+    else:
+        txt = await month_screen_text()
+    await update.effective_chat.send_message(txt, reply_markup=kb_main())
 
     return ST_MENU
 
@@ -1014,77 +1403,102 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     logger.exception("Unhandled error: %s", context.error)
     try:
         if isinstance(update, Update) and update.effective_message:
-            await update.effective_message.reply_text("Ой, что-то пошло не так 🙈 Попробуем ещё раз?")
+            await update.effective_message.reply_text(ERROR_TEXT)
     except Exception:
         pass
 
 
+async def _on_shutdown(app: Application) -> None:
+    await close_http_session()
+
+
 def build_app() -> Application:
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        # все тексты бота в HTML; Markdown указываем явно там, где он нужен
+        .defaults(Defaults(parse_mode=ParseMode.HTML))
+        # общий и по-чатовый лимит исходящих запросов + повтор после RetryAfter;
+        # общий лимит чуть ниже телеграмных 30/с, чтобы не ловить 429 на всплесках
+        .rate_limiter(AIORateLimiter(overall_max_rate=28, overall_time_period=1, max_retries=3))
+        .post_shutdown(_on_shutdown)
+        .build()
+    )
 
     conv = ConversationHandler(
         entry_points=[CommandHandler("start", cmd_start)],
         states={
             ST_MENU: [
-                CallbackQueryHandler(on_menu, pattern=r"^menu:"),
+                CallbackQueryHandler(on_menu, pattern=PAT_MENU),
             ],
             ST_ADD_CHOOSE_TYPE: [
-                CallbackQueryHandler(choose_type, pattern=r"^type:"),
-                CallbackQueryHandler(back_router, pattern=r"^back:"),
+                CallbackQueryHandler(choose_type, pattern=PAT_TYPE),
+                CallbackQueryHandler(back_router, pattern=PAT_BACK),
             ],
             ST_EXP_CATEGORY: [
-                CallbackQueryHandler(expense_category, pattern=r"^expcat:\d+$"),
-                CallbackQueryHandler(back_router, pattern=r"^back:"),
+                CallbackQueryHandler(expense_category, pattern=PAT_EXP_CAT),
+                CallbackQueryHandler(back_router, pattern=PAT_BACK),
             ],
             ST_EXP_SUBCATEGORY: [
-                CallbackQueryHandler(expense_subcategory, pattern=r"^expsub:\d+$"),
-                CallbackQueryHandler(back_router, pattern=r"^back:"),
+                CallbackQueryHandler(expense_subcategory, pattern=PAT_EXP_SUB),
+                CallbackQueryHandler(back_router, pattern=PAT_BACK),
             ],
             ST_INC_CATEGORY: [
-                CallbackQueryHandler(income_category, pattern=r"^inccat:\d+$"),
-                CallbackQueryHandler(back_router, pattern=r"^back:"),
+                CallbackQueryHandler(income_category, pattern=PAT_INC_CAT),
+                CallbackQueryHandler(back_router, pattern=PAT_BACK),
             ],
             ST_AMOUNT: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, amount_received),
+                MessageHandler(_TEXT_NOT_CMD, amount_received),
             ],
             ST_COMMENT: [
-                CallbackQueryHandler(comment_skip, pattern=r"^comment:skip$"),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, comment_received),
+                CallbackQueryHandler(comment_skip, pattern=PAT_COMMENT_SKIP),
+                MessageHandler(_TEXT_NOT_CMD, comment_received),
             ],
             ST_ANALYSIS_KIND: [
-                CallbackQueryHandler(analysis_kind, pattern=r"^akind:"),
-                CallbackQueryHandler(back_router, pattern=r"^back:"),
+                CallbackQueryHandler(analysis_kind, pattern=PAT_AKIND),
+                CallbackQueryHandler(back_router, pattern=PAT_BACK),
             ],
             ST_ANALYSIS_PERIOD: [
-                CallbackQueryHandler(analysis_period, pattern=r"^aperiod:"),
-                CallbackQueryHandler(back_router, pattern=r"^back:"),
+                CallbackQueryHandler(analysis_period, pattern=PAT_APERIOD),
+                CallbackQueryHandler(back_router, pattern=PAT_BACK),
             ],
             ST_SET_BALANCE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, set_balance_received),
+                MessageHandler(_TEXT_NOT_CMD, set_balance_received),
             ],
             ST_EDIT_SELECT: [
-                CallbackQueryHandler(edit_select_row, pattern=r"^edit_row:\d+$"),
-                CallbackQueryHandler(back_router, pattern=r"^back:"),
+                CallbackQueryHandler(edit_select_row, pattern=PAT_EDIT_ROW),
+                CallbackQueryHandler(back_router, pattern=PAT_BACK),
             ],
             ST_EDIT_FIELD: [
-                CallbackQueryHandler(edit_field_selected, pattern=r"^edit_field:"),
-                CallbackQueryHandler(back_router, pattern=r"^back:"),
+                CallbackQueryHandler(edit_field_selected, pattern=PAT_EDIT_FIELD),
+                CallbackQueryHandler(back_router, pattern=PAT_BACK),
             ],
             ST_EDIT_VALUE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, edit_value_received),
+                MessageHandler(_TEXT_NOT_CMD, edit_value_received),
             ],
         },
         fallbacks=[CommandHandler("help", cmd_help)],
         allow_reentry=True,
     )
 
+    # группа -1 отрабатывает раньше сценария и может остановить обработку апдейта,
+    # группа 1 — после него
+    app.add_handler(CallbackQueryHandler(drop_double_tap), group=-1)
     app.add_handler(conv)
+    app.add_handler(CallbackQueryHandler(remember_callback), group=1)
     app.add_handler(CommandHandler("help", cmd_help))
     app.add_error_handler(error_handler)
     return app
 
 
 def run():
+    # [+] uvloop, если установлен (на Windows его нет — остаёмся на стандартном цикле)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
     app = build_app()
 
     # [+] Graceful shutdown для Railway
@@ -1098,14 +1512,17 @@ def run():
         await close_http_session()
         loop.stop()
 
+    def _schedule_shutdown(sig: signal.Signals) -> None:
+        loop.create_task(_shutdown(sig.name))
+
     for sig in (signal.SIGTERM, signal.SIGINT):
         try:
-            loop.add_signal_handler(sig, lambda s=sig: asyncio.ensure_future(_shutdown(s.name)))
+            loop.add_signal_handler(sig, _schedule_shutdown, sig)
         except NotImplementedError:
             pass
 
     if WEBHOOK_URL:
-        url_path = WEBHOOK_PATH or _default_webhook_path()
+        url_path = WEBHOOK_PATH or _DEFAULT_WEBHOOK_PATH
         full_webhook = f"{WEBHOOK_URL.rstrip('/')}/{url_path}"
         logger.info("Starting webhook on 0.0.0.0:%s", PORT)
         app.run_webhook(